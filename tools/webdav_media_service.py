@@ -2,13 +2,19 @@
 """Misuzu Music WebDAV media service.
 
 持续运行在服务器侧：
-1. 扫描指定根目录的音频文件，使用 ffprobe/ffmpeg 生成元数据 JSON 与封面 PNG；
-2. 将所有元数据与封面合并为单个二进制包（library.bundle）；
+1. 扫描指定根目录的音频文件，使用 ffprobe/ffmpeg 生成元数据 JSON 与多尺寸 WebP 封面；
+2. 将所有元数据与封面合并为单个二进制包（library.bundle），并发布小体积的变更清单
+   （library.manifest，含 generation、包文件 SHA-256、大小、条目数与构建时间），
+   客户端轮询清单即可判断是否需要重新下载包；同时发布 library.stats，
+   包含最常播放/最近播放榜单与按天播放历史，客户端无需扫描全库；
 3. 监听播放日志目录（playlogs），把客户端上传的播放日志二进制合并到主包的统计信息中；
+   也可通过 --ingest-socket/--ingest-port 在本地 socket 上直接接收同格式的播放日志，
+   先写入 WAL，再按 --commit-interval 批量合并；
 4. 处理完成后自动删除播放日志文件。
 
 运行示例：
     python3 tools/webdav_media_service.py /data/disk1/music
+    python3 tools/webdav_media_service.py --once --workers 8 /data/disk1/music  # 一次性批量导入
 
 必备依赖：ffmpeg/ffprobe、python3 标准库。
 """
@@ -17,17 +23,27 @@ from __future__ import annotations
 
 import argparse
 import hashlib
+import heapq
 import json
 import os
 import shutil
 import struct
 import subprocess
+import socketserver
+import stat
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional, TextIO
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
 
 AUDIO_EXTENSIONS = {
     '.mp3', '.flac', '.m4a', '.aac', '.wav', '.ogg', '.opus', '.wma',
@@ -36,12 +52,48 @@ AUDIO_EXTENSIONS = {
 
 MAGIC_METADATA = b'MMDB'
 MAGIC_PLAYLOG = b'MMLG'
+# 包尾部可选的 ingest 提交序号段；旧客户端按条目数读取，会忽略这段尾部数据
+MAGIC_INGEST_SEQ = b'MMSQ'
 BUNDLE_VERSION = 1
 PLAYLOG_VERSION = 1
+MANIFEST_VERSION = 1
+STATS_VERSION = 1
+
+# 播放统计：排行榜长度与按天历史的窗口天数
+STATS_TOP_N = 50
+STATS_HISTORY_DAYS = 30
+MS_PER_DAY = 86_400_000
+# 客户端时间戳允许超前服务器时钟的最大值，超出的按当前时间记
+MAX_CLOCK_SKEW_MS = 10 * 60 * 1000
+
+# --once 模式的退出码（致命错误为 1）：部分文件处理失败；部分文件因无封面被跳过
+EXIT_PARTIAL_FAILURE = 2
+EXIT_SKIPPED_FILES = 3
+# 另一进程（常驻服务或另一个 --once）正持有同一根目录的锁
+EXIT_LOCKED = 4
 
 METADATA_DIRNAME = '.misuzu'
 METADATA_BUNDLE_NAME = 'library.bundle'
+METADATA_MANIFEST_NAME = 'library.manifest'
+METADATA_STATS_NAME = 'library.stats'
 PLAYLOG_DIRNAME = 'playlogs'
+LOCK_FILENAME = 'service.lock'
+INGEST_WAL_NAME = 'ingest.wal'
+
+# 单个 socket 载荷上限（字节），防止异常客户端占满内存
+INGEST_MAX_PAYLOAD = 16 * 1024 * 1024
+# 单个连接读取载荷的超时秒数
+INGEST_READ_TIMEOUT = 30
+
+# 缩略图宽度（像素），最小的一档同时作为包内嵌封面与 thumbnail_file
+THUMBNAIL_SIZES = (160, 320, 640)
+
+# _regeneration_mode 的返回值：完整重建（ffprobe + 全部封面）或仅补齐缺失的缩略图
+REGENERATE_FULL = 'full'
+REGENERATE_VARIANTS = 'variants'
+
+# writev 单次提交的缓冲区数量上限（需不超过 IOV_MAX，Linux 为 1024）
+WRITE_BATCH_SIZE = 1024
 
 
 class MediaServiceError(RuntimeError):
@@ -76,14 +128,85 @@ def run_ffprobe(audio_path: Path) -> dict:
         raise MediaServiceError(f'ffprobe invalid JSON for {audio_path}: {exc}') from exc
 
 
+def thumbnail_path_for(audio_path: Path, size: int) -> Path:
+    # 文件名只由宽度决定；旧版单一缩略图 .thumb.webp 仅在重建时兼容读取
+    return audio_path.with_suffix(f'.thumb{size}.webp')
+
+
+def parse_thumbnail_sizes(value: str) -> List[int]:
+    try:
+        sizes = sorted({int(part) for part in value.split(',') if part.strip()})
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f'无效的缩略图尺寸: {value}') from exc
+    if not sizes or sizes[0] <= 0:
+        raise argparse.ArgumentTypeError(f'无效的缩略图尺寸: {value}')
+    return sizes
+
+
+def build_cover_command(
+    source: Path,
+    fullsize_webp: Optional[Path],
+    thumbnails: Dict[int, Path],
+) -> List[str]:
+    """ffmpeg command that decodes source once and splits it into every output."""
+    sizes = sorted(thumbnails)
+    outputs = len(sizes) + (1 if fullsize_webp is not None else 0)
+    split_labels = ''.join(f'[s{index}]' for index in range(len(sizes)))
+    full_label = '[full]' if fullsize_webp is not None else ''
+    filter_parts = [f'[0:v:0]split={outputs}{full_label}{split_labels}']
+    for index, size in enumerate(sizes):
+        # 宽度不超过源图，避免小封面被放大成比原图还大的“缩略图”
+        filter_parts.append(
+            f"[s{index}]scale=w='min({size},iw)':h=-2:flags=lanczos[t{index}]"
+        )
+
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-i', str(source),
+        '-filter_complex', ';'.join(filter_parts),
+    ]
+    if fullsize_webp is not None:
+        cmd += [
+            '-map', '[full]',
+            '-frames:v', '1',
+            '-quality', '94',
+            '-compression_level', '4',
+            str(fullsize_webp),
+        ]
+    for index, size in enumerate(sizes):
+        cmd += [
+            '-map', f'[t{index}]',
+            '-frames:v', '1',
+            '-quality', '85',
+            '-compression_level', '4',
+            str(thumbnails[size]),
+        ]
+    return cmd
+
+
+def extract_thumbnail_variants(fullsize_webp: Path, thumbnails: Dict[int, Path]) -> None:
+    """Encode the given thumbnail sizes from an existing full-size WebP."""
+    cmd = build_cover_command(fullsize_webp, None, thumbnails)
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as exc:  # pragma: no cover - runtime tool
+        for target in thumbnails.values():
+            target.unlink(missing_ok=True)
+        raise MediaServiceError(
+            f'thumbnail encode failed for {fullsize_webp}: '
+            f'{exc.stderr.decode(errors="replace").strip()}'
+        ) from exc
+
+
 def extract_cover_images(
     audio_path: Path,
     fullsize_webp: Path,
-    thumbnail_webp: Path,
+    thumbnails: Dict[int, Path],
     existing_png: Optional[Path] = None,
 ) -> bool:
-    temp_png = audio_path.with_suffix('.__cover_tmp.png')
-    for target in (fullsize_webp, thumbnail_webp, temp_png):
+    """Decode the cover once and encode the full WebP plus every thumbnail size."""
+    targets = [fullsize_webp, *thumbnails.values()]
+    for target in targets:
         if target.exists():
             target.unlink()
 
@@ -95,64 +218,21 @@ def extract_cover_images(
                 png_source = candidate
                 break
 
-    if png_source is None:
-        extract_cmd = [
-            'ffmpeg', '-v', 'error', '-y',
-            '-i', str(audio_path),
-            '-map', '0:v:0',
-            '-frames:v', '1',
-            str(temp_png),
-        ]
-
-        try:
-            subprocess.run(extract_cmd, check=True, capture_output=True)
-            png_source = temp_png if temp_png.exists() else None
-        except subprocess.CalledProcessError:  # pragma: no cover - runtime tool
-            if temp_png.exists():
-                temp_png.unlink()
-            return False
+    # 没有外部 PNG 时直接从音频的内嵌封面流解码，不再落地临时 PNG
+    source = png_source if png_source is not None else audio_path
 
-    if png_source is None:
-        return False
-
-    convert_full_cmd = [
-        'ffmpeg', '-v', 'error', '-y',
-        '-i', str(png_source),
-        '-quality', '94',
-        '-compression_level', '4',
-        str(fullsize_webp),
-    ]
+    cmd = build_cover_command(source, fullsize_webp, thumbnails)
 
     try:
-        subprocess.run(convert_full_cmd, check=True, capture_output=True)
-    except subprocess.CalledProcessError as exc:  # pragma: no cover
-        debug(f'  ⚠️ WebP 转换失败 (full) -> {exc.stderr.strip()}')
-        for target in (temp_png, fullsize_webp, thumbnail_webp):
-            target.unlink(missing_ok=True)
-        return False
-
-    convert_thumb_cmd = [
-        'ffmpeg', '-v', 'error', '-y',
-        '-i', str(png_source),
-        '-vf', 'scale=160:-1:flags=lanczos',
-        '-quality', '85',
-        '-compression_level', '4',
-        str(thumbnail_webp),
-    ]
-
-    try:
-        subprocess.run(convert_thumb_cmd, check=True, capture_output=True)
-    except subprocess.CalledProcessError as exc:  # pragma: no cover
-        debug(f'  ⚠️ 缩略图转换失败 -> {exc.stderr.strip()}')
-        for target in (temp_png, thumbnail_webp):
+        subprocess.run(cmd, check=True, capture_output=True)
+    except subprocess.CalledProcessError as exc:  # pragma: no cover - runtime tool
+        if png_source is not None:
+            debug(f'  ⚠️ WebP 转换失败 -> {exc.stderr.decode(errors="replace").strip()}')
+        for target in targets:
             target.unlink(missing_ok=True)
-        fullsize_webp.unlink(missing_ok=True)
         return False
-    finally:
-        if png_source is temp_png:
-            temp_png.unlink(missing_ok=True)
 
-    return fullsize_webp.exists() and thumbnail_webp.exists()
+    return all(target.exists() for target in targets)
 
 
 def compute_sha1_first_chunk(audio_path: Path, chunk_size: int = 10240) -> str:
@@ -163,6 +243,45 @@ def compute_sha1_first_chunk(audio_path: Path, chunk_size: int = 10240) -> str:
     return h.hexdigest()
 
 
+def acquire_root_lock(meta_dir: Path) -> Optional[TextIO]:
+    """Take the exclusive per-root lock; return the open lock file, or None if held."""
+    meta_dir.mkdir(exist_ok=True)
+    lock_file = (meta_dir / LOCK_FILENAME).open('a')
+    if fcntl is None:  # pragma: no cover - Windows
+        return lock_file
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def write_buffers(fd: int, buffers: List[bytes]) -> None:
+    """Write all buffers to fd with as few syscalls as possible."""
+    if not hasattr(os, 'writev'):  # pragma: no cover - Windows
+        for start in range(0, len(buffers), WRITE_BATCH_SIZE):
+            data = b''.join(buffers[start:start + WRITE_BATCH_SIZE])
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        return
+
+    pending = [memoryview(buf) for buf in buffers if buf]
+    while pending:
+        batch = pending[:WRITE_BATCH_SIZE]
+        written = os.writev(fd, batch)
+        consumed = 0
+        for buf in batch:
+            if written < len(buf):
+                break
+            written -= len(buf)
+            consumed += 1
+        del pending[:consumed]
+        if written:
+            pending[0] = pending[0][written:]
+
+
 def normalize_tags(raw_tags: Optional[dict]) -> Dict[str, str]:
     tags: Dict[str, str] = {}
     if not raw_tags:
@@ -230,16 +349,230 @@ class TrackMetadata:
     stats: TrackStat = field(default_factory=TrackStat)
 
 
+class TopN:
+    """Bounded top-N by a per-key score that only ever increases.
+
+    堆中允许存在过期条目（惰性删除），以 ``scores`` 为准；每次更新 O(log N)。
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.scores: Dict[str, int] = {}
+        self._heap: List[tuple[int, str]] = []
+
+    def update(self, key: str, score: int) -> None:
+        if self.size <= 0 or score <= 0:
+            return
+        if key in self.scores:
+            if score <= self.scores[key]:
+                return
+        elif len(self.scores) >= self.size:
+            self._prune()
+            min_score, min_key = self._heap[0]
+            if score <= min_score:
+                return
+            heapq.heappop(self._heap)
+            del self.scores[min_key]
+        self.scores[key] = score
+        heapq.heappush(self._heap, (score, key))
+        if len(self._heap) > 4 * self.size:
+            self._heap = [(value, name) for name, value in self.scores.items()]
+            heapq.heapify(self._heap)
+
+    def _prune(self) -> None:
+        while self._heap and self.scores.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def ranked(self) -> List[tuple[str, int]]:
+        return sorted(self.scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class DailyHistogram:
+    """Ring buffer of per-day play counts covering the last ``days`` days."""
+
+    __slots__ = ('counts', 'end_day')
+
+    def __init__(self, days: int):
+        self.counts = [0] * days
+        self.end_day: Optional[int] = None
+
+    def add(self, day: int, amount: int = 1) -> None:
+        days = len(self.counts)
+        if self.end_day is None:
+            self.end_day = day
+        elif day > self.end_day:
+            if day - self.end_day >= days:
+                self.counts = [0] * days
+            else:
+                for stale in range(self.end_day + 1, day + 1):
+                    self.counts[stale % days] = 0
+            self.end_day = day
+        elif day <= self.end_day - days:
+            return  # 早于窗口的条目直接丢弃
+        self.counts[day % days] += amount
+
+    def window(self, end_day: int) -> List[int]:
+        """Counts for ``end_day - days + 1 .. end_day``, oldest first."""
+        days = len(self.counts)
+        result = [0] * days
+        if self.end_day is None:
+            return result
+        for index, day in enumerate(range(end_day - days + 1, end_day + 1)):
+            if self.end_day - days < day <= self.end_day:
+                result[index] = self.counts[day % days]
+        return result
+
+    def sparse(self, end_day: int) -> Dict[str, int]:
+        """Non-zero counts keyed by offset from ``end_day - days + 1``."""
+        days = len(self.counts)
+        result: Dict[str, int] = {}
+        if self.end_day is None:
+            return result
+        first_day = end_day - days + 1
+        for day in range(max(first_day, self.end_day - days + 1), min(end_day, self.end_day) + 1):
+            count = self.counts[day % days]
+            if count:
+                result[str(day - first_day)] = count
+        return result
+
+
+class PlayStatistics:
+    """Incremental aggregates maintained while merging playlogs."""
+
+    def __init__(self, top_n: int, history_days: int):
+        self.history_days = history_days
+        self.most_played = TopN(top_n)
+        self.recently_played = TopN(top_n)
+        self.daily_totals = DailyHistogram(history_days)
+        self.daily: Dict[str, DailyHistogram] = {}
+        # (end_day, track_id) 小根堆，用于淘汰窗口内已全为 0 的直方图；允许过期条目
+        self._expiry: List[tuple[int, str]] = []
+
+    def seed(self, tracks: Iterable[TrackMetadata]) -> None:
+        now_ms = int(time.time() * 1000)
+        for track in tracks:
+            self.most_played.update(track.track_id, track.stats.play_count)
+            self.recently_played.update(
+                track.track_id,
+                min(track.stats.last_play_timestamp_ms, now_ms),
+            )
+
+    def record(self, track: TrackMetadata, timestamp_ms: int) -> None:
+        self.most_played.update(track.track_id, track.stats.play_count)
+        self.recently_played.update(track.track_id, track.stats.last_play_timestamp_ms)
+
+        day = timestamp_ms // MS_PER_DAY
+        self._add_daily(track.track_id, day, 1)
+        self.daily_totals.add(day)
+
+    def _add_daily(self, track_id: str, day: int, count: int) -> None:
+        histogram = self.daily.get(track_id)
+        if histogram is None:
+            histogram = self.daily[track_id] = DailyHistogram(self.history_days)
+        previous_end = histogram.end_day
+        histogram.add(day, count)
+        if histogram.end_day != previous_end:
+            heapq.heappush(self._expiry, (histogram.end_day, track_id))
+
+    def evict(self, end_day: int) -> None:
+        cutoff = end_day - self.history_days
+        while self._expiry and self._expiry[0][0] <= cutoff:
+            expired_day, track_id = heapq.heappop(self._expiry)
+            histogram = self.daily.get(track_id)
+            if histogram is not None and histogram.end_day == expired_day:
+                del self.daily[track_id]
+
+    def load(self, data: dict) -> None:
+        if data.get('version') != STATS_VERSION:
+            return
+        if data.get('history_days') != self.history_days:
+            debug('Stats history window changed, discarding stored daily history.')
+            return
+        end_day = data.get('end_day')
+        if not isinstance(end_day, int):
+            return
+        first_day = end_day - self.history_days + 1
+        today = int(time.time() * 1000) // MS_PER_DAY
+        for track_id, counts in (data.get('daily_history') or {}).items():
+            for offset, count in sorted(counts.items(), key=lambda item: int(item[0])):
+                day = first_day + int(offset)
+                if count and 0 <= int(offset) < self.history_days and day <= today:
+                    self._add_daily(track_id, day, count)
+        for offset, count in enumerate((data.get('daily_totals') or [])[:self.history_days]):
+            if count and first_day + offset <= today:
+                self.daily_totals.add(first_day + offset, count)
+
+    def to_json(self, tracks: Dict[str, TrackMetadata]) -> dict:
+        # 窗口只由服务器时钟决定，客户端时间戳不能推动它
+        end_day = int(time.time() * 1000) // MS_PER_DAY
+
+        def path_of(track_id: str) -> Optional[str]:
+            track = tracks.get(track_id)
+            return track.relative_path if track else None
+
+        self.evict(end_day)
+        daily_history: Dict[str, Dict[str, int]] = {}
+        for track_id, histogram in self.daily.items():
+            counts = histogram.sparse(end_day)
+            if counts:
+                daily_history[track_id] = counts
+
+        return {
+            'version': STATS_VERSION,
+            'history_days': self.history_days,
+            'end_day': end_day,
+            'most_played': [
+                {'track_id': track_id, 'relative_path': path_of(track_id), 'play_count': score}
+                for track_id, score in self.most_played.ranked()
+            ],
+            'recently_played': [
+                {
+                    'track_id': track_id,
+                    'relative_path': path_of(track_id),
+                    'last_play_timestamp_ms': score,
+                }
+                for track_id, score in self.recently_played.ranked()
+            ],
+            'daily_totals': self.daily_totals.window(end_day),
+            'daily_history': daily_history,
+        }
+
+
 class MediaLibrary:
-    def __init__(self, root: Path):
+    def __init__(
+        self,
+        root: Path,
+        thumbnail_sizes: Iterable[int] = THUMBNAIL_SIZES,
+        top_n: int = STATS_TOP_N,
+        history_days: int = STATS_HISTORY_DAYS,
+    ):
         self.root = root
+        self.thumbnail_sizes = sorted(set(thumbnail_sizes))
         self.meta_dir = root / METADATA_DIRNAME
         self.bundle_path = self.meta_dir / METADATA_BUNDLE_NAME
+        self.manifest_path = self.meta_dir / METADATA_MANIFEST_NAME
+        self.stats_path = self.meta_dir / METADATA_STATS_NAME
         self.playlog_dir = self.meta_dir / PLAYLOG_DIRNAME
         self.meta_dir.mkdir(exist_ok=True)
         self.playlog_dir.mkdir(exist_ok=True)
         self.tracks: Dict[str, TrackMetadata] = {}
+        # 序列化缓存：仅在对应曲目变化时失效，save_bundle 只重新编码变化的曲目
+        self._record_cache: Dict[str, tuple[bytes, bytes]] = {}
+        self._stats_cache: Dict[str, bytes] = {}
+        self._sorted_ids: Optional[List[str]] = None
+        self._manifest: dict = {}
+        # 已合并进包的最后一个 ingest WAL 记录序号，随包原子写入
+        self.ingest_seq = 0
+        self.failed_files: List[Path] = []
+        self.skipped_files: List[Path] = []
+        # 主循环与 ingest 提交线程共享曲目表与序列化缓存
+        self.lock = threading.RLock()
+        # 首轮扫描（元数据生成 + 从 JSON 重建）完成后置位
+        self.loaded = threading.Event()
+        self.play_stats = PlayStatistics(top_n, max(history_days, 1))
         self._load_existing_bundle()
+        self._load_manifest()
+        self._load_play_stats()
 
     # ------------------------------------------------------------------
     # Bundle load/save
@@ -251,7 +584,7 @@ class MediaLibrary:
 
         data = self.bundle_path.read_bytes()
         try:
-            entries = self._parse_bundle(data)
+            entries, self.ingest_seq = self._parse_bundle(data)
         except Exception as exc:  # pragma: no cover - tool runtime
             debug(f'Failed to parse existing bundle: {exc}. Ignoring.')
             return
@@ -261,7 +594,7 @@ class MediaLibrary:
         debug(f'Loaded {len(self.tracks)} entries from existing bundle.')
 
     @staticmethod
-    def _parse_bundle(data: bytes) -> List[TrackMetadata]:
+    def _parse_bundle(data: bytes) -> tuple[List[TrackMetadata], int]:
         mv = memoryview(data)
         offset = 0
 
@@ -313,111 +646,367 @@ class MediaLibrary:
             )
             entries.append(entry)
 
+        ingest_seq = 0
+        if len(mv) - offset == 12 and bytes(mv[offset:offset + 4]) == MAGIC_INGEST_SEQ:
+            ingest_seq = struct.unpack('<Q', require(12)[4:])[0]
         if offset != len(mv):  # pragma: no cover - runtime safety
             debug('Warning: extra bytes detected at end of bundle.')
-        return entries
+        return entries, ingest_seq
 
-    def save_bundle(self) -> None:
-        entries = list(self.tracks.values())
-        entries.sort(key=lambda e: e.track_id)
+    def _load_manifest(self) -> None:
+        if not self.manifest_path.exists():
+            return
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as exc:  # pragma: no cover - tool runtime
+            debug(f'Failed to parse manifest: {exc}. Ignoring.')
+            return
+        if isinstance(manifest, dict):
+            self._manifest = manifest
 
-        tmp_path = self.bundle_path.with_suffix('.tmp')
-        with tmp_path.open('wb') as fp:
-            fp.write(
-                struct.pack(
-                    '<4sHHQI',
-                    MAGIC_METADATA,
-                    BUNDLE_VERSION,
-                    0,
-                    int(time.time() * 1000),
-                    len(entries),
-                ),
+    def _load_play_stats(self) -> None:
+        # 排行榜由包内统计一次性重建；按天历史只保存在 library.stats 中
+        self.play_stats.seed(self.tracks.values())
+        if not self.stats_path.exists():
+            return
+        try:
+            data = json.loads(self.stats_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as exc:  # pragma: no cover - tool runtime
+            debug(f'Failed to parse stats: {exc}. Ignoring.')
+            return
+        if isinstance(data, dict):
+            self.play_stats.load(data)
+
+    def save_bundle(self) -> bool:
+        """Write bundle and manifest; return False when the content is unchanged."""
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self.tracks)
+        track_ids = self._sorted_ids
+
+        # 变更令牌：由各曲目记录的缓存摘要与统计字节得出，不含头部构建时间戳，
+        # 只用于判断内容是否变化；包文件本身的 SHA-256 在写入时另行计算
+        change_token = hashlib.sha256(struct.pack('<I', len(track_ids)))
+        body: List[bytes] = []
+        for track_id in track_ids:
+            entry = self.tracks[track_id]
+            cached = self._record_cache.get(track_id)
+            if cached is None:
+                record = self._encode_record(entry)
+                cached = (record, hashlib.sha256(record).digest())
+                self._record_cache[track_id] = cached
+            stats = self._stats_cache.get(track_id)
+            if stats is None:
+                stats = struct.pack(
+                    '<IQ',
+                    entry.stats.play_count,
+                    entry.stats.last_play_timestamp_ms,
+                )
+                self._stats_cache[track_id] = stats
+            change_token.update(cached[1])
+            change_token.update(stats)
+            body.append(cached[0])
+            body.append(stats)
+        if self.ingest_seq:
+            trailer = struct.pack('<4sQ', MAGIC_INGEST_SEQ, self.ingest_seq)
+            change_token.update(trailer)
+            body.append(trailer)
+
+        token = change_token.hexdigest()
+        bundle_unchanged = (
+            self._manifest.get('change_token') == token
+            and self.bundle_path.exists()
+        )
+
+        # 统计单独判定：榜单长度/窗口等配置变化或历史被丢弃时，包不变也要重写
+        stats_bytes = json.dumps(
+            self.play_stats.to_json(self.tracks),
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode('utf-8')
+        stats_digest = hashlib.sha256(stats_bytes).hexdigest()
+        stats_unchanged = (
+            self._manifest.get('stats_sha256') == stats_digest
+            and self.stats_path.exists()
+        )
+
+        if bundle_unchanged and stats_unchanged:
+            debug('Bundle content unchanged, skipping write.')
+            return False
+
+        manifest = dict(self._manifest)
+        if not bundle_unchanged:
+            timestamp_ms = int(time.time() * 1000)
+            header = struct.pack(
+                '<4sHHQI',
+                MAGIC_METADATA,
+                BUNDLE_VERSION,
+                0,
+                timestamp_ms,
+                len(track_ids),
             )
+            buffers = [header, *body]
+            file_hash = hashlib.sha256()
+            for buf in buffers:
+                file_hash.update(buf)
+
+            tmp_path = self.bundle_path.with_suffix('.tmp')
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+            fd = os.open(tmp_path, flags, 0o644)
+            try:
+                write_buffers(fd, buffers)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            os.replace(tmp_path, self.bundle_path)
+            debug(f'Bundle updated: {self.bundle_path} ({len(track_ids)} entries).')
+            manifest.update({
+                'generation': int(manifest.get('generation', 0)) + 1,
+                'change_token': token,
+                'sha256': file_hash.hexdigest(),
+                'size': sum(len(buf) for buf in buffers),
+                'entry_count': len(track_ids),
+                'built_at_ms': timestamp_ms,
+            })
+
+        if not stats_unchanged:
+            self._write_bytes_atomic(self.stats_path, stats_bytes)
+            manifest.update({
+                'stats_generation': int(manifest.get('stats_generation', 0)) + 1,
+                'stats_sha256': stats_digest,
+                'stats_size': len(stats_bytes),
+            })
+
+        manifest['version'] = MANIFEST_VERSION
+        self._manifest = manifest
+        # 清单在包与统计替换完成之后写入，客户端看到新的 generation 时对应文件一定已就绪
+        self._write_bytes_atomic(
+            self.manifest_path,
+            json.dumps(manifest, separators=(',', ':')).encode('utf-8'),
+        )
+        return True
 
-            for entry in entries:
-                metadata_bytes = json.dumps(
-                    entry.metadata_json,
-                    ensure_ascii=False,
-                ).encode('utf-8')
-                artwork_bytes = (
-                    entry.artwork_path.read_bytes() if entry.artwork_path else b''
-                )
+    @staticmethod
+    def _write_bytes_atomic(path: Path, data: bytes) -> None:
+        tmp_path = path.with_name(path.name + '.tmp')
+        with tmp_path.open('wb') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
 
-                key_bytes = entry.metadata_json.get(
-                    'relative_path',
-                    entry.relative_path,
-                ).encode('utf-8')
-                track_id_bytes = entry.track_id.encode('utf-8')
-
-                fp.write(struct.pack('<H', len(key_bytes)))
-                fp.write(key_bytes)
-                fp.write(struct.pack('<B', len(track_id_bytes)))
-                fp.write(track_id_bytes)
-                fp.write(struct.pack('<I', len(metadata_bytes)))
-                fp.write(metadata_bytes)
-                fp.write(struct.pack('<I', len(artwork_bytes)))
-                fp.write(artwork_bytes)
-                fp.write(struct.pack('<I', entry.stats.play_count))
-                fp.write(struct.pack('<Q', entry.stats.last_play_timestamp_ms))
-
-        tmp_path.replace(self.bundle_path)
-        debug(f'Bundle updated: {self.bundle_path} ({len(entries)} entries).')
+    @staticmethod
+    def _encode_record(entry: TrackMetadata) -> bytes:
+        """Encode everything of a bundle record except the trailing stats."""
+        metadata_bytes = json.dumps(
+            entry.metadata_json,
+            ensure_ascii=False,
+        ).encode('utf-8')
+        artwork_bytes = (
+            entry.artwork_path.read_bytes() if entry.artwork_path else b''
+        )
+
+        key_bytes = entry.metadata_json.get(
+            'relative_path',
+            entry.relative_path,
+        ).encode('utf-8')
+        track_id_bytes = entry.track_id.encode('utf-8')
+
+        return b''.join((
+            struct.pack('<H', len(key_bytes)),
+            key_bytes,
+            struct.pack('<B', len(track_id_bytes)),
+            track_id_bytes,
+            struct.pack('<I', len(metadata_bytes)),
+            metadata_bytes,
+            struct.pack('<I', len(artwork_bytes)),
+            artwork_bytes,
+        ))
+
+    def _invalidate_track(self, track_id: str, stats_only: bool = False) -> None:
+        self._stats_cache.pop(track_id, None)
+        if not stats_only:
+            self._record_cache.pop(track_id, None)
 
     # ------------------------------------------------------------------
     # Metadata generation
     # ------------------------------------------------------------------
-    def ensure_metadata(self) -> bool:
-        """Return True if any metadata/cover was generated or updated."""
-        changed = False
+    def ensure_metadata(self, workers: int = 1, progress: bool = False) -> bool:
+        """Return True if any metadata/cover was generated or updated.
+
+        ffprobe/ffmpeg 以子进程运行，workers > 1 时用线程池并行处理；
+        处理失败的文件记录在 ``self.failed_files`` 中，因无法提取封面而跳过
+        （未写入元数据、不会进入包）的文件记录在 ``self.skipped_files`` 中。
+        """
+        pending: List[tuple[Path, Callable[[Path], Optional[str]]]] = []
         for audio_path in self.iter_audio_files():
-            json_path = audio_path.with_suffix('.json')
-            fullsize_webp = audio_path.with_suffix('.webp')
-            thumb_webp = audio_path.with_suffix('.thumb.webp')
+            mode = self._regeneration_mode(audio_path)
+            if mode == REGENERATE_FULL:
+                pending.append((audio_path, self._generate_metadata))
+            elif mode == REGENERATE_VARIANTS:
+                pending.append((audio_path, self._generate_thumbnail_variants))
+        self.failed_files = []
+        self.skipped_files = []
+        if not pending:
+            return False
 
-            regenerate = False
-            if json_path.exists():
+        changed = False
+        total = len(pending)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {
+                executor.submit(worker, audio_path): audio_path
+                for audio_path, worker in pending
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                audio_path = futures[future]
                 try:
-                    regenerate = json_path.stat().st_mtime < audio_path.stat().st_mtime
-                except OSError:
-                    regenerate = False
-            else:
-                regenerate = True
+                    track_id = future.result()
+                except Exception as exc:  # pragma: no cover - runtime tool
+                    debug(f'  ⚠️ 元数据生成失败 {audio_path.relative_to(self.root)}: {exc}')
+                    self.failed_files.append(audio_path)
+                    track_id = None
+                else:
+                    if track_id is None:
+                        self.skipped_files.append(audio_path)
+
+                if track_id is not None:
+                    # 封面可能在路径不变的情况下被重新生成，需丢弃缓存的封面字节
+                    with self.lock:
+                        self._invalidate_track(track_id)
+                    changed = True
+
+                if progress:
+                    elapsed = time.monotonic() - started
+                    eta = elapsed / done * (total - done)
+                    debug(
+                        f'[处理 {done}/{total}] {done * 100 // total}% '
+                        f'ETA {int(eta) // 60:02d}:{int(eta) % 60:02d} '
+                        f'-> {audio_path.relative_to(self.root)}'
+                    )
+        return changed
 
-            if not fullsize_webp.exists() or not thumb_webp.exists():
-                regenerate = True
+    def _cover_targets(self, audio_path: Path) -> tuple[Path, Dict[int, Path]]:
+        fullsize_webp = audio_path.with_suffix('.webp')
+        thumbnails = {
+            size: thumbnail_path_for(audio_path, size) for size in self.thumbnail_sizes
+        }
+        return fullsize_webp, thumbnails
+
+    def _remove_stale_thumbnails(
+        self,
+        audio_path: Path,
+        previous: Optional[dict],
+        thumbnails: Dict[int, Path],
+    ) -> None:
+        """Delete the legacy .thumb.webp and variants no longer configured."""
+        keep = set(thumbnails.values())
+        candidates = [audio_path.with_suffix('.thumb.webp')]
+        for rel in ((previous or {}).get('thumbnails') or {}).values():
+            if isinstance(rel, str):
+                candidates.append(self.root / rel.lstrip('/'))
+        prefix = audio_path.stem + '.thumb'
+        for path in candidates:
+            # 只删除属于这首曲目的缩略图，sidecar 中的路径不可完全信任
+            if (
+                path not in keep
+                and path.parent == audio_path.parent
+                and path.name.startswith(prefix)
+                and path.suffix == '.webp'
+            ):
+                path.unlink(missing_ok=True)
 
-            if not regenerate:
-                continue
+    @staticmethod
+    def _read_sidecar(json_path: Path) -> Optional[dict]:
+        try:
+            data = json.loads(json_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
 
-            action = '更新' if json_path.exists() else '生成'
-            debug(f'{action}元数据 -> {audio_path.relative_to(self.root)}')
+    def _regeneration_mode(self, audio_path: Path) -> Optional[str]:
+        """Return what needs regenerating for audio_path, or None if up to date."""
+        json_path = audio_path.with_suffix('.json')
+        fullsize_webp, thumbnails = self._cover_targets(audio_path)
 
-            legacy_png = audio_path.with_suffix('.png')
-            if not extract_cover_images(
-                audio_path,
-                fullsize_webp,
-                thumb_webp,
-                existing_png=legacy_png if legacy_png.exists() else None,
-            ):
-                debug('  ⚠️ 封面提取失败，跳过')
-                continue
+        if not json_path.exists() or not fullsize_webp.exists():
+            return REGENERATE_FULL
+        try:
+            if json_path.stat().st_mtime < audio_path.stat().st_mtime:
+                return REGENERATE_FULL
+        except OSError:
+            pass
+
+        # 仅缺少部分尺寸（如新增了 --thumbnail-sizes）时只从已有大图补齐缩略图
+        if not all(path.exists() for path in thumbnails.values()):
+            return REGENERATE_VARIANTS
+        return None
 
-            metadata = self._extract_metadata(audio_path)
-            metadata['has_cover'] = True
-            metadata['cover_file'] = '/' + str(fullsize_webp.relative_to(self.root)).replace('\\', '/')
-            metadata['thumbnail_file'] = '/' + str(thumb_webp.relative_to(self.root)).replace('\\', '/')
+    def _generate_thumbnail_variants(self, audio_path: Path) -> Optional[str]:
+        """Encode missing thumbnail sizes and update the sidecar; return the track id."""
+        json_path = audio_path.with_suffix('.json')
+        fullsize_webp, thumbnails = self._cover_targets(audio_path)
+        missing = {size: path for size, path in thumbnails.items() if not path.exists()}
+
+        debug(f'补齐缩略图 {sorted(missing)} -> {audio_path.relative_to(self.root)}')
+        extract_thumbnail_variants(fullsize_webp, missing)
+
+        metadata = self._read_sidecar(json_path)
+        if metadata is None:
+            raise MediaServiceError(f'Unreadable sidecar: {json_path}')
+        self._remove_stale_thumbnails(audio_path, metadata, thumbnails)
+        thumb_webp = thumbnails[self.thumbnail_sizes[0]]
+        metadata['thumbnail_file'] = '/' + str(thumb_webp.relative_to(self.root)).replace('\\', '/')
+        metadata['thumbnails'] = {
+            str(size): '/' + str(path.relative_to(self.root)).replace('\\', '/')
+            for size, path in thumbnails.items()
+        }
+        json_path.write_text(
+            json.dumps(metadata, ensure_ascii=False, indent=2),
+            encoding='utf-8',
+        )
+        return metadata.get('hash_sha1_first_10kb')
+
+    def _generate_metadata(self, audio_path: Path) -> Optional[str]:
+        """Write sidecar JSON and covers; return the track id, or None if skipped."""
+        json_path = audio_path.with_suffix('.json')
+        fullsize_webp, thumbnails = self._cover_targets(audio_path)
+        thumb_webp = thumbnails[self.thumbnail_sizes[0]]
+
+        previous = self._read_sidecar(json_path) if json_path.exists() else None
+        action = '更新' if json_path.exists() else '生成'
+        debug(f'{action}元数据 -> {audio_path.relative_to(self.root)}')
+
+        legacy_png = audio_path.with_suffix('.png')
+        if not extract_cover_images(
+            audio_path,
+            fullsize_webp,
+            thumbnails,
+            existing_png=legacy_png if legacy_png.exists() else None,
+        ):
+            debug(f'  ⚠️ 封面提取失败，跳过 -> {audio_path.relative_to(self.root)}')
+            return None
 
-            json_path.write_text(
-                json.dumps(metadata, ensure_ascii=False, indent=2),
-                encoding='utf-8',
-            )
+        metadata = self._extract_metadata(audio_path)
+        metadata['has_cover'] = True
+        metadata['cover_file'] = '/' + str(fullsize_webp.relative_to(self.root)).replace('\\', '/')
+        metadata['thumbnail_file'] = '/' + str(thumb_webp.relative_to(self.root)).replace('\\', '/')
+        # 各尺寸缩略图，客户端据此选择不小于显示尺寸的最小版本
+        metadata['thumbnails'] = {
+            str(size): '/' + str(path.relative_to(self.root)).replace('\\', '/')
+            for size, path in thumbnails.items()
+        }
 
-            legacy_png = audio_path.with_suffix('.png')
-            if legacy_png.exists():
-                legacy_png.unlink()
+        json_path.write_text(
+            json.dumps(metadata, ensure_ascii=False, indent=2),
+            encoding='utf-8',
+        )
+        self._remove_stale_thumbnails(audio_path, previous, thumbnails)
 
-            changed = True
-        return changed
+        if legacy_png.exists():
+            legacy_png.unlink()
+
+        return metadata['hash_sha1_first_10kb']
 
     def _extract_metadata(self, audio_path: Path) -> dict:
         probe = run_ffprobe(audio_path)
@@ -502,8 +1091,14 @@ class MediaLibrary:
                 continue
             if json_path.suffix.lower() != '.json':
                 continue
-            with json_path.open('r', encoding='utf-8') as fp:
-                metadata_json = json.load(fp)
+            try:
+                with json_path.open('r', encoding='utf-8') as fp:
+                    metadata_json = json.load(fp)
+            except (OSError, ValueError) as exc:
+                debug(f'⚠️ Unreadable metadata {json_path}: {exc}')
+                continue
+            if not isinstance(metadata_json, dict):
+                continue
 
             track_id = metadata_json.get('hash_sha1_first_10kb')
             if not track_id:
@@ -539,6 +1134,12 @@ class MediaLibrary:
 
             existing = self.tracks.get(track_id)
             if existing:
+                if (
+                    existing.metadata_json != metadata_json
+                    or existing.relative_path != relative_path
+                    or existing.artwork_path != artwork_path
+                ):
+                    self._invalidate_track(track_id)
                 existing.metadata_json = metadata_json
                 existing.relative_path = relative_path
                 existing.artwork_path = artwork_path
@@ -549,6 +1150,7 @@ class MediaLibrary:
                     metadata_json=metadata_json,
                     artwork_path=artwork_path,
                 )
+                self._sorted_ids = None
                 changed = True
         return changed
 
@@ -569,14 +1171,7 @@ class MediaLibrary:
                 log_path.unlink(missing_ok=True)
                 continue
 
-            for timestamp_ms, track_id in entries:
-                track = self.tracks.get(track_id)
-                if not track:
-                    debug(f'⚠️ Playlog entry for unknown track {track_id}, skipping.')
-                    continue
-                track.stats.play_count += 1
-                if timestamp_ms > track.stats.last_play_timestamp_ms:
-                    track.stats.last_play_timestamp_ms = timestamp_ms
+            if self.merge_play_entries(entries):
                 changed = True
 
             log_path.unlink(missing_ok=True)
@@ -584,6 +1179,26 @@ class MediaLibrary:
 
         return changed
 
+    def merge_play_entries(self, entries: Iterable[tuple[int, str]]) -> bool:
+        changed = False
+        now_ms = int(time.time() * 1000)
+        for timestamp_ms, track_id in entries:
+            track = self.tracks.get(track_id)
+            if not track:
+                debug(f'⚠️ Playlog entry for unknown track {track_id}, skipping.')
+                continue
+            if timestamp_ms > now_ms + MAX_CLOCK_SKEW_MS:
+                # 客户端时钟超前：未来时间戳会把按天窗口整体推后、清空真实历史
+                debug(f'⚠️ Future playlog timestamp {timestamp_ms} for {track_id}, clamped.')
+                timestamp_ms = now_ms
+            track.stats.play_count += 1
+            if timestamp_ms > track.stats.last_play_timestamp_ms:
+                track.stats.last_play_timestamp_ms = timestamp_ms
+            self.play_stats.record(track, timestamp_ms)
+            self._invalidate_track(track_id, stats_only=True)
+            changed = True
+        return changed
+
     @staticmethod
     def _parse_playlog(data: bytes) -> List[tuple[int, str]]:
         mv = memoryview(data)
@@ -614,10 +1229,245 @@ class MediaLibrary:
         return entries
 
 
-def main() -> None:
+class _IngestTCPServer(socketserver.ThreadingTCPServer):
+    # 快速重启时旧连接仍处于 TIME_WAIT，需要复用地址
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _IngestUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class PlaylogIngest:
+    """Local socket ingestion of MMLG playlogs with a write-ahead log.
+
+    每个连接发送一个完整的 MMLG 载荷后关闭写端，服务为载荷分配递增序号并连同
+    序号追加进 WAL、fsync 之后回复 ``OK <条目数>``。条目先缓存在内存中，由提交
+    线程按固定间隔批量合并进库；已合并的最大序号随包原子写入（包尾部 MMSQ 段），
+    重启重放 WAL 时跳过序号不大于它的记录，因此崩溃不会重复计数。
+    主循环完成首轮扫描（``library.loaded``）之前不提交：此时曲目表缺少封面路径，
+    新曲目也尚未入库，提交会发布丢失封面的包或把条目当作未知曲目丢弃。
+    """
+
+    def __init__(self, library: MediaLibrary, commit_interval: float):
+        self.library = library
+        self.commit_interval = commit_interval
+        self.wal_path = library.playlog_dir / INGEST_WAL_NAME
+        self._lock = threading.Lock()
+        # (序号, 原始载荷, 解析后的条目)
+        self._pending: List[tuple[int, bytes, List[tuple[int, str]]]] = []
+        self._next_seq = library.ingest_seq + 1
+        self._servers: List[socketserver.BaseServer] = []
+        self._replay_wal()
+        self._wal = self.wal_path.open('ab')
+
+    def _replay_wal(self) -> None:
+        if not self.wal_path.exists():
+            return
+        data = self.wal_path.read_bytes()
+        if not data:
+            return
+        offset = 0
+        header_size = struct.calcsize('<IQ')
+        recovered = 0
+        while offset + header_size <= len(data):
+            size, seq = struct.unpack_from('<IQ', data, offset)
+            start = offset + header_size
+            if start + size > len(data):
+                break  # 崩溃时写了一半的尾部记录，丢弃
+            payload = data[start:start + size]
+            offset = start + size
+            self._next_seq = max(self._next_seq, seq + 1)
+            if seq <= self.library.ingest_seq:
+                continue  # 已随包提交
+            try:
+                entries = MediaLibrary._parse_playlog(payload)
+            except (MediaServiceError, UnicodeDecodeError, struct.error) as exc:  # pragma: no cover
+                debug(f'Skipping corrupt WAL record: {exc}')
+                continue
+            self._pending.append((seq, payload, entries))
+            recovered += len(entries)
+        if offset != len(data):
+            debug('Warning: truncated record at end of ingest WAL.')
+        debug(f'Recovered {recovered} uncommitted entries from ingest WAL.')
+
+    def accept(self, payload: bytes) -> int:
+        entries = MediaLibrary._parse_playlog(payload)
+        if not entries:
+            return 0
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._wal.write(_encode_wal_record(seq, payload))
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._pending.append((seq, payload, entries))
+        return len(entries)
+
+    def commit(self) -> bool:
+        if not self.library.loaded.is_set():
+            return False
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return False
+
+        entries = [entry for _seq, _payload, records in batch for entry in records]
+        with self.library.lock:
+            self.library.merge_play_entries(entries)
+            # 序号与计数随同一次包写入落盘，重放时据此跳过已提交的记录
+            self.library.ingest_seq = max(self.library.ingest_seq, batch[-1][0])
+            self.library.save_bundle()
+
+        with self._lock:
+            # 提交期间到达的载荷仍在 _pending 中，重写 WAL 仅保留这部分
+            self._rewrite_wal()
+        debug(f'Ingest group commit: {len(entries)} entries.')
+        return True
+
+    def _rewrite_wal(self) -> None:
+        self._wal.close()
+        if not self._pending:
+            self.wal_path.unlink(missing_ok=True)
+        else:
+            tmp_path = self.wal_path.with_name(self.wal_path.name + '.tmp')
+            with tmp_path.open('wb') as fp:
+                for seq, payload, _entries in self._pending:
+                    fp.write(_encode_wal_record(seq, payload))
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp_path, self.wal_path)
+        self._wal = self.wal_path.open('ab')
+
+    def _commit_loop(self) -> None:
+        while True:
+            time.sleep(self.commit_interval)
+            try:
+                self.commit()
+            except Exception as exc:  # pragma: no cover - runtime loop safety
+                debug(f'Ingest commit failed: {exc}')
+
+    def _make_handler(self) -> type:
+        ingest = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            # 不关闭写端的客户端不能无限占用处理线程
+            timeout = INGEST_READ_TIMEOUT
+
+            def handle(self) -> None:
+                try:
+                    payload = self.rfile.read(INGEST_MAX_PAYLOAD + 1)
+                except TimeoutError:
+                    self.wfile.write(b'ERR read timeout\n')
+                    return
+                if len(payload) > INGEST_MAX_PAYLOAD:
+                    self.wfile.write(b'ERR payload too large\n')
+                    return
+                try:
+                    count = ingest.accept(payload)
+                except (MediaServiceError, UnicodeDecodeError, struct.error) as exc:
+                    self.wfile.write(f'ERR {exc}\n'.encode('utf-8'))
+                    return
+                self.wfile.write(f'OK {count}\n'.encode('utf-8'))
+
+        return Handler
+
+    def start(self, socket_path: Optional[Path], port: Optional[int]) -> None:
+        handler = self._make_handler()
+        if socket_path is not None:
+            if socket_path.is_symlink() or socket_path.exists():
+                if not stat.S_ISSOCK(socket_path.lstat().st_mode):
+                    raise MediaServiceError(f'Refusing to replace non-socket file: {socket_path}')
+                socket_path.unlink()
+            self._servers.append(_IngestUnixServer(str(socket_path), handler))
+            debug(f'Playlog ingest listening on {socket_path}')
+        if port is not None:
+            self._servers.append(_IngestTCPServer(('127.0.0.1', port), handler))
+            debug(f'Playlog ingest listening on 127.0.0.1:{port}')
+
+        for server in self._servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._commit_loop, daemon=True).start()
+
+
+def _encode_wal_record(seq: int, payload: bytes) -> bytes:
+    return struct.pack('<IQ', len(payload), seq) + payload
+
+
+def run_once(service: MediaLibrary, workers: int) -> int:
+    """Single bulk-import pass; return an exit status suitable for cron."""
+    started = time.monotonic()
+    service.ensure_metadata(workers=workers, progress=True)
+    service.rebuild_bundle_from_json()
+    service.process_play_logs()
+    service.save_bundle()
+
+    failed = len(service.failed_files)
+    skipped = len(service.skipped_files)
+    debug(
+        f'Bulk import finished in {time.monotonic() - started:.1f}s: '
+        f'{len(service.tracks)} tracks, {failed} failed, '
+        f'{skipped} skipped (no cover, not in bundle).'
+    )
+    for audio_path in service.skipped_files:
+        debug(f'  skipped: {audio_path.relative_to(service.root)}')
+    if failed:
+        return EXIT_PARTIAL_FAILURE
+    if skipped:
+        return EXIT_SKIPPED_FILES
+    return 0
+
+
+def main() -> int:
     parser = argparse.ArgumentParser(description='Misuzu Music WebDAV media service')
     parser.add_argument('root', type=Path, help='音频根目录（WebDAV 挂载点）')
     parser.add_argument('--interval', type=int, default=60, help='循环间隔秒数（默认 60）')
+    parser.add_argument(
+        '--thumbnail-sizes',
+        type=parse_thumbnail_sizes,
+        default=list(THUMBNAIL_SIZES),
+        help='逗号分隔的缩略图宽度（默认 160,320,640）',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='并行处理的 ffprobe/ffmpeg 任务数（默认 CPU 核数）',
+    )
+    parser.add_argument(
+        '--top-n',
+        type=int,
+        default=STATS_TOP_N,
+        help=f'library.stats 中最常播放/最近播放榜单长度（默认 {STATS_TOP_N}）',
+    )
+    parser.add_argument(
+        '--history-days',
+        type=int,
+        default=STATS_HISTORY_DAYS,
+        help=f'按天播放历史保留的天数（默认 {STATS_HISTORY_DAYS}）',
+    )
+    parser.add_argument(
+        '--ingest-socket',
+        type=Path,
+        help='播放日志 ingest 的 Unix socket 路径（可选）',
+    )
+    parser.add_argument(
+        '--ingest-port',
+        type=int,
+        help='播放日志 ingest 的本地 TCP 端口，仅监听 127.0.0.1（可选）',
+    )
+    parser.add_argument(
+        '--commit-interval',
+        type=float,
+        default=2.0,
+        help='ingest 条目批量合并的间隔秒数（默认 2）',
+    )
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='执行一次完整导入（元数据、封面与包）后退出，适合首次导入或 cron',
+    )
     args = parser.parse_args()
 
     root = args.root.resolve()
@@ -628,28 +1478,54 @@ def main() -> None:
         if not shutil.which(binary):
             raise SystemExit(f'Missing dependency: {binary}')
 
-    service = MediaLibrary(root)
+    # 同一根目录只允许一个进程写包与清单，否则临时文件与 generation 会互相覆盖
+    root_lock = acquire_root_lock(root / METADATA_DIRNAME)
+    if root_lock is None:
+        debug(f'Another process holds {root / METADATA_DIRNAME / LOCK_FILENAME}, exiting.')
+        return EXIT_LOCKED
+
+    service = MediaLibrary(
+        root,
+        thumbnail_sizes=args.thumbnail_sizes,
+        top_n=args.top_n,
+        history_days=args.history_days,
+    )
+    if args.once:
+        return run_once(service, args.workers)
+
+    if args.ingest_socket is not None or args.ingest_port is not None:
+        ingest = PlaylogIngest(service, max(args.commit_interval, 0.1))
+        ingest.start(args.ingest_socket, args.ingest_port)
+
     debug(f'Service started. Root={root}')
 
     while True:
         changed = False
         try:
-            if service.ensure_metadata():
+            if service.ensure_metadata(workers=args.workers):
                 debug('Metadata generation finished, rebuilding bundle...')
                 changed = True
 
-            if service.rebuild_bundle_from_json():
-                debug('Metadata map updated from JSON.')
-                changed = True
-
-            if service.process_play_logs():
-                debug('Playlog merge completed.')
-                changed = True
-
-            if changed:
-                service.save_bundle()
+            with service.lock:
+                if service.rebuild_bundle_from_json():
+                    debug('Metadata map updated from JSON.')
+                    changed = True
+
+                if service.process_play_logs():
+                    debug('Playlog merge completed.')
+                    changed = True
+
+                if (
+                    changed
+                    or not service.manifest_path.exists()
+                    or not service.stats_path.exists()
+                ):
+                    service.save_bundle()
         except Exception as exc:  # pragma: no cover - runtime loop safety
             debug(f'Unexpected error: {exc}')
+        finally:
+            # 首轮即使失败也放行 ingest 提交，避免待提交条目无限堆积
+            service.loaded.set()
 
         time.sleep(max(args.interval, 5))
 
@@ -657,7 +1533,7 @@ def main() -> None:
 if __name__ == '__main__':
     try:
         import shutil  # noqa: WPS433 - imported late for dependency check
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:  # pragma: no cover
         debug('Service interrupted by user.')
     except MediaServiceError as exc: